@@ -5,8 +5,10 @@
 #   ow = OneWire(machine.Pin(21))
 #   ds = ds18x20.DS18X20(ow)
 #   roms = ds.scan()
-#   ds.convert_temp(); time.sleep_ms(750)
-#   print(ds.read_temp(roms[0]))
+#   tconv = max(ds.set_resolution(r, 9) for r in roms)   # 可选：9~12 bit
+#   ds.convert_temp()
+#   while not ds.conversion_done(): time.sleep_ms(10)     # 或固定等待 tconv
+#   print(ds.read_temps(roms))
 
 try:
     from micropython import const
@@ -22,6 +24,12 @@ _FAM_DS18S20 = const(0x10)
 _FAM_DS1822  = const(0x22)
 _FAM_DS18B20 = const(0x28)
 
+# 9/10/11/12-bit 最大转换时间（ms，datasheet）
+_TCONV_MS = (94, 188, 375, 750)
+
+def conversion_ms(bits):
+    return _TCONV_MS[min(12, max(9, bits)) - 9]
+
 class DS18X20:
     def __init__(self, onewire):
         self.ow = onewire
@@ -38,6 +46,10 @@ class DS18X20:
         self.ow.writebyte(_SKIP_ROM)
         self.ow.writebyte(_CONVERT)
 
+    def conversion_done(self):
+        # 非阻塞：转换进行中读时隙返回 0，完成后返回 1（需外部供电；寄生供电请按 tconv 等待）
+        return self.ow.readbit() == 1
+
     def read_scratch(self, rom):
         self.ow.reset(True)
         self.ow.select_rom(rom)
@@ -57,8 +69,20 @@ class DS18X20:
         self.ow.writebyte(_WR_SCRATCH)
         self.ow.write(th_tls)
 
-    def read_temp(self, rom):
+    def set_resolution(self, rom, bits):
+        # 写配置字节设置分辨率（9~12 bit），保留 TH/TL；返回该探头所需转换时间(ms)
+        # DS18S20 固定 9-bit 输出、转换时间固定 750ms，无配置字节
+        if rom[0] == _FAM_DS18S20:
+            return _TCONV_MS[3]
+        bits = min(12, max(9, bits))
         buf = self.read_scratch(rom)
+        self.write_scratch(rom, bytearray((buf[2], buf[3], ((bits - 9) << 5) | 0x1F)))
+        return conversion_ms(bits)
+
+    def read_temp(self, rom):
+        return self._decode(rom, self.read_scratch(rom))
+
+    def _decode(self, rom, buf):
         fam = rom[0]
         if fam == _FAM_DS18S20:
             # DS18S20: 9-bit，特殊补偿
@@ -71,7 +95,23 @@ class DS18X20:
         else:
             # DS18B20/DS1822: 16-bit，LSB 在 buf[0]
             t = (buf[1] << 8) | buf[0]
+            # 低分辨率时未定义的低位清零（config 字节 bit6:5 = R1:R0）
+            res = (buf[4] >> 5) & 0x03
+            t &= ~((1 << (3 - res)) - 1) & 0xFFFF
             if t & 0x8000:  # 负数
                 t = -((t ^ 0xFFFF) + 1)
             return t / 16.0
 
+    def read_temps(self, roms):
+        # 批量读取：逐个读暂存器并做 CRC 校验；失败的探头返回 None，不影响其它探头
+        out = []
+        for rom in roms:
+            try:
+                # 全 0 暂存器 CRC 也为 0（数据线对地短路），同样视为无效
+                buf = self.read_scratch(rom)
+                if not any(buf):
+                    raise ValueError("DS18X20 scratchpad all zero")
+                out.append(self._decode(rom, buf))
+            except Exception:
+                out.append(None)
+        return out
@@ -79,3 +79,22 @@ class I2cLcd(LcdApi):
                 ((data & 0x0f) << SHIFT_DATA))
         self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
         self.i2c.writeto(self.i2c_addr, bytes([byte]))
+
+    def hal_write_data_run(self, data):
+        # Write a run of data bytes in a single I2C transaction. Each byte
+        # expands to the same four PCF8574 writes as hal_write_data (high
+        # nibble with E, high nibble, low nibble with E, low nibble).
+        n = len(data)
+        buf = bytearray(n * 4)
+        base = MASK_RS | (self.backlight << SHIFT_BACKLIGHT)
+        j = 0
+        for i in range(n):
+            d = data[i]
+            hi = base | (((d >> 4) & 0x0f) << SHIFT_DATA)
+            lo = base | ((d & 0x0f) << SHIFT_DATA)
+            buf[j] = hi | MASK_E
+            buf[j + 1] = hi
+            buf[j + 2] = lo | MASK_E
+            buf[j + 3] = lo
+            j += 4
+        self.i2c.writeto(self.i2c_addr, buf)
@@ -182,6 +182,14 @@ class LcdApi:
         # It is expected that a derived HAL class will implement this function.
         raise NotImplementedError
 
+    def hal_write_data_run(self, data):
+        # Write a run of data bytes to the LCD starting at the current
+        # cursor position. The controller auto-increments the address, so no
+        # cursor moves are needed in between. A derived HAL class may override
+        # this to batch the transfer.
+        for byte in data:
+            self.hal_write_data(byte)
+
     def hal_sleep_us(self, usecs):
         # Sleep for some time (given in microseconds)
         time.sleep_us(usecs)
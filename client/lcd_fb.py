@@ -0,0 +1,80 @@
+# lcd_fb.py — 字符 LCD 影子帧缓冲（基于 LcdApi）
+# - frame：期望显示内容；shadow：屏上实际内容
+# - flush() 只发送变化的字符格，连续变化的一段用一次 move_to + 一次批量写
+# 用法:
+#   fb = LcdFrameBuffer(i2c_lcd)
+#   fb.line(0, "Hello"); fb.line(1, "26.4\xdfC Warm")
+#   fb.flush()
+
+
+class LcdFrameBuffer:
+    def __init__(self, lcd):
+        self.lcd = lcd
+        self.cols = lcd.num_columns
+        self.rows = lcd.num_lines
+        self.frame = bytearray(b" " * (self.cols * self.rows))
+        self.shadow = bytearray(self.frame)
+        self.dirty = False
+        # 与屏幕同步：清屏后屏上全是空格
+        lcd.clear()
+
+    def write(self, x, y, s):
+        # 在 (x, y) 写入字符串（超出行宽截断，不换行）
+        if y < 0 or y >= self.rows or x >= self.cols:
+            return
+        off = y * self.cols
+        end = off + self.cols
+        i = off + x
+        for ch in s:
+            if i >= end:
+                break
+            c = ord(ch) & 0xFF  # "\xdf" 等 LCD 字库码按单字节写
+            if self.frame[i] != c:
+                self.frame[i] = c
+                self.dirty = True
+            i += 1
+
+    def line(self, y, s):
+        # 整行替换：不足行宽用空格补齐
+        s = s[:self.cols]
+        self.write(0, y, s)
+        if len(s) < self.cols:
+            self.write(len(s), y, " " * (self.cols - len(s)))
+
+    def invalidate(self):
+        # 屏幕内容未知（如外部直接写过 LCD）→ 下次 flush 全量重画
+        for i in range(len(self.shadow)):
+            self.shadow[i] = 0
+        self.dirty = True
+
+    def flush(self):
+        # 逐行找出变化的字符段；间隔 ≤1 格的段合并（一次 move_to 的开销约等于 1 个字符）
+        if not self.dirty:
+            return 0
+        frame, shadow, cols = self.frame, self.shadow, self.cols
+        sent = 0
+        for y in range(self.rows):
+            off = y * cols
+            x = 0
+            while x < cols:
+                if frame[off + x] == shadow[off + x]:
+                    x += 1
+                    continue
+                start = x
+                last = x
+                x += 1
+                while x < cols:
+                    if frame[off + x] != shadow[off + x]:
+                        last = x
+                    elif x - last > 1:
+                        break
+                    x += 1
+                a, b = off + start, off + last + 1
+                run = frame[a:b]
+                self.lcd.move_to(start, y)
+                self.lcd.hal_write_data_run(run)
+                self.lcd.cursor_x = last + 1
+                shadow[a:b] = run
+                sent += b - a
+        self.dirty = False
+        return sent
@@ -0,0 +1,87 @@
+# ledstrip.py — 温度→颜色查找表 + 脏标记 NeoPixel 输出
+# - ColorLut：启动时按 DS18B20 分辨率（1/16 °C）预计算颜色，运行时只做整数查表
+# - LedStrip：直接写 NeoPixel 自带的 buf（已按线序排好），内容没变就不 write()
+# 用法:
+#   lut = ColorLut(color_from_temp, 20, 32, order=np.ORDER)
+#   strip = LedStrip(np)
+#   strip.fill_index(lut, lut.index(t)); strip.show()
+
+
+class ColorLut:
+    def __init__(self, color_fn, t_min, t_max, steps=16, order=(1, 0, 2)):
+        # color_fn(t) -> (r, g, b)；order 为 NeoPixel 线序（GRB = (1, 0, 2)）
+        self.t_min = t_min
+        self.steps = steps
+        self.n = int((t_max - t_min) * steps) + 1
+        self.table = bytearray(self.n * 3)
+        for i in range(self.n):
+            rgb = color_fn(t_min + i / steps)
+            o = i * 3
+            for c in range(3):
+                self.table[o + order[c]] = rgb[c]
+
+    def index(self, t):
+        # 温度 → 表下标（四舍五入到 1/16 °C，越界夹到两端）
+        i = int((t - self.t_min) * self.steps + 0.5)
+        if i < 0: return 0
+        if i >= self.n: return self.n - 1
+        return i
+
+
+class LedStrip:
+    def __init__(self, np):
+        self.np = np
+        self.buf = np.buf                    # 预分配的线序缓冲
+        self.n = len(self.buf) // 3
+        self.shown = bytearray(len(self.buf))  # 上次 write() 时的内容
+        self._tmp = bytearray(len(self.buf))   # rotate() 用的暂存
+        self._force = True                   # 上电后灯带状态未知，首次必写
+
+    def _set(self, p, table, i):
+        o, s = p * 3, i * 3
+        self.buf[o] = table[s]
+        self.buf[o + 1] = table[s + 1]
+        self.buf[o + 2] = table[s + 2]
+
+    def fill_index(self, lut, i):
+        # 全部像素设为 lut 第 i 项：先写第一个像素，再按倍增方式复制
+        L = len(self.buf)
+        if not L: return
+        self._set(0, lut.table, i)
+        mv = memoryview(self.buf)
+        k = 3
+        while k < L:
+            m = k if k < L - k else L - k
+            mv[k:k + m] = mv[0:m]
+            k += m
+
+    def gradient(self, lut, i0, i1):
+        # 逐像素渐变：第 p 个像素取 lut 中 i0→i1 的线性插值项（整数运算）
+        n = self.n
+        d = n - 1 if n > 1 else 1
+        for p in range(n):
+            self._set(p, lut.table, i0 + (i1 - i0) * p // d)
+
+    def rotate(self, k=1):
+        # 动画用：像素整体循环移动 k 位（不分配新内存）
+        L = len(self.buf)
+        if not L: return
+        b = (k % self.n) * 3
+        if not b: return
+        mv, tmp = memoryview(self.buf), self._tmp
+        tmp[0:L - b] = mv[b:L]
+        tmp[L - b:L] = mv[0:b]
+        self.buf[:] = tmp
+
+    def off(self):
+        for i in range(len(self.buf)):
+            self.buf[i] = 0
+
+    def show(self):
+        # 内容与上次相同则跳过 bit-bang 写
+        if not self._force and self.buf == self.shown:
+            return False
+        self.np.write()
+        self.shown[:] = self.buf
+        self._force = False
+        return True
@@ -1,15 +1,21 @@
 # ESP32 MicroPython —— DS18B20 + 双按钮 + 灯带 + I2C LCD + UDP上报（稳定版）
 # - WiFi 连接更稳：连上即打印 & 首包心跳；断线指数回退重连
-# - DS18B20 启动先同步采样一次，随后异步周期采样（12-bit 需 ~750ms）
+# - DS18B20 全部探头轮询转换完成标志，完成即读取（不再固定等待 ~750ms）
 # - UDP 上报：域名解析并缓存；按钮立刻触发一次上报，便于联调
+# - uasyncio 协作式任务：传感器 / 网络 / 显示 / 按钮，各自只在有事可做时唤醒
 
-import network, socket, machine, time
+import network, socket, machine, time, os
 from machine import Pin, SoftI2C
 import neopixel
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 # ==== 若固件未内置 onewire/ds18x20，请先上传同名 .py 到设备根目录 ====
 from onewire import OneWire
 import ds18x20
+from ledstrip import ColorLut, LedStrip
 
 # ---------------- 基本配置 ----------------
 HOST  = "temp.heilomeow.com"   # ✅ 你的公网域名
@@ -25,7 +31,9 @@ I2C_SDA, I2C_SCL = 13, 14
 # 温度传感器（DS18B20）
 TEMP_PIN       = 5
 TEMP_PERIOD_S  = 1.0
-TEMP_TCONV_MS  = 750  # 12-bit 转换典型 750ms（datasheet/驱动文档）  # noqa
+TEMP_RES_BITS  = 12   # 9~12 bit；转换时间 94/188/375/750ms（datasheet/驱动文档）  # noqa
+TEMP_TCONV_MS  = ds18x20.conversion_ms(TEMP_RES_BITS)  # 最长等待；启动时按实际探头重新计算
+TEMP_POLL_MS   = 10   # 轮询转换完成标志的间隔
 
 # 温度→颜色映射
 TEMP_MIN = 20
@@ -47,6 +55,9 @@ vote_val = 0
 # 上报节流
 SEND_INTERVAL_S = 2.0
 
+# Wi-Fi 连接中的轮询间隔（ms）
+WIFI_POLL_MS = 200
+
 # Wi-Fi 非阻塞状态机
 CONNECT_TIMEOUT_MS = 8000
 RETRY_BASE_MS      = 5000
@@ -63,6 +74,8 @@ wlan = network.WLAN(network.STA_IF)
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.settimeout(0.0)  # 非阻塞发送
 _last_send_ms = 0
+_send_seq = 0          # 上报序号（16 位滚动），服务端据此统计丢包/乱序/重复
+_boot_id = "{:04x}".format(int.from_bytes(os.urandom(2), "big"))  # 本次开机的随机标识，服务端据此识别重启
 _peer_addr = None      # 缓存 (ip, port)
 _peer_addr_ts = 0      # 上次解析时间
 _PEER_TTL_MS = 5 * 60 * 1000  # 解析缓存5分钟
@@ -75,42 +88,38 @@ np = neopixel.NeoPixel(Pin(LEDSTRIP_PIN_NUM, Pin.OUT), NUM_LEDS, bpp=3, timing=1
 i2c = SoftI2C(sda=Pin(I2C_SDA), scl=Pin(I2C_SCL), freq=100000)
 try:
     from i2c_lcd import I2cLcd
+    from lcd_fb import LcdFrameBuffer
     addrs = i2c.scan()
     if not addrs: raise OSError("No I2C addr found")
     i2c_lcd = I2cLcd(i2c, addrs[0], 2, 16)
-    i2c_lcd.clear()
+    lcd_fb = LcdFrameBuffer(i2c_lcd)  # 影子帧缓冲：只发送变化的字符格
 except Exception as e:
     i2c_lcd = None
+    lcd_fb = None
     print("LCD init failed:", e)
 
-last_line1 = ""
-last_line2 = ""
-
 # DS18B20：异步采样状态
 ow = OneWire(Pin(TEMP_PIN))
 ds = ds18x20.DS18X20(ow)
 _roms = ds.scan()
-_temp_pending = False
-_temp_conv_ms = 0
-_next_temp_start_ms = 0
-last_temp = None  # 最近温度
+last_temp = None   # 最近温度（第一个探头）
+last_temps = []    # 全部探头的最近温度（读失败为 None）
+
+# 任务间通知：IRQ 只置标志，真正的 LCD / 网络操作在任务里做
+_btn_flag = asyncio.ThreadSafeFlag()  # 按钮 IRQ → button_task
+_send_evt = asyncio.Event()           # 请求立即上报 → net_task
+_disp_evt = asyncio.Event()           # 帧缓冲有变化 → display_task
 
 # ---------------- LCD/显示 ----------------
 def display_line1(s: str):
-    global last_line1
-    if i2c_lcd is None: return
-    if s != last_line1:
-        i2c_lcd.move_to(0, 0); i2c_lcd.putstr(" "*16)
-        i2c_lcd.move_to(0, 0); i2c_lcd.putstr(s[:16])
-        last_line1 = s
+    if lcd_fb is None: return
+    lcd_fb.line(0, s)
+    if lcd_fb.dirty: _disp_evt.set()
 
 def display_line2(s: str):
-    global last_line2
-    if i2c_lcd is None: return
-    if s != last_line2:
-        i2c_lcd.move_to(0, 1); i2c_lcd.putstr(" "*16)
-        i2c_lcd.move_to(0, 1); i2c_lcd.putstr(s[:16])
-        last_line2 = s
+    if lcd_fb is None: return
+    lcd_fb.line(1, s)
+    if lcd_fb.dirty: _disp_evt.set()
 
 def vote_to_tag(v):
     v = 0 if v is None else int(v)
@@ -157,6 +166,10 @@ def color_from_temp(t):
         rgb = lerp3(MID_RGB, WARM_RGB, u)
     return apply_dim_and_gamma(rgb)
 
+# 启动时预计算颜色表（1/16 °C 一档），运行时只查表
+_lut = ColorLut(color_from_temp, TEMP_MIN, TEMP_MAX, 16, getattr(np, "ORDER", (1, 0, 2)))
+strip = LedStrip(np)
+
 # ---------------- 按钮（IRQ + 软消抖） ----------------
 class Button:
     def __init__(self, pin_num, on_press, active_low=True):
@@ -177,49 +190,64 @@ class Button:
             print("btn err:", e)
 
 def set_vote(delta):
+    # IRQ 上下文：只改投票值并置标志，LCD 与上报交给 button_task
     global vote_val
     vote_val = clamp(vote_val + delta, VOTE_MIN, VOTE_MAX)
-    render_vote_line(vote_val)
-    try_send(last_temp, vote_val, force=True)  # ✅ 按一下立刻上报一包
+    _btn_flag.set()
 
 BTN1 = Button(BTN1_PIN, lambda: set_vote(+1), active_low=True)
 BTN2 = Button(BTN2_PIN, lambda: set_vote(-1), active_low=True)
 
 # ---------------- DS18B20 采样 ----------------
-def temp_tick():
-    """异步：发起 convert_temp()；等待 TEMP_TCONV_MS；read_temp()；刷新 last_temp 与 LCD"""
-    global _temp_pending, _temp_conv_ms, _next_temp_start_ms, last_temp
+def setup_probes():
+    """给所有探头设置分辨率；转换等待取最慢探头所需时间"""
+    global TEMP_TCONV_MS
+    tconv = 0
+    for rom in _roms:
+        try:
+            tconv = max(tconv, ds.set_resolution(rom, TEMP_RES_BITS))
+        except Exception as e:
+            print("set_resolution err:", e)
+            tconv = max(tconv, ds18x20.conversion_ms(12))
+    if tconv:
+        TEMP_TCONV_MS = tconv
+
+def read_probes():
+    """读取全部探头 → last_temps；第一个探头有效时刷新 last_temp、LCD 与灯带"""
+    global last_temp, last_temps
+    vals = ds.read_temps(_roms)  # CRC 校验失败的探头为 None
+    last_temps = vals
+    if vals and vals[0] is not None:
+        last_temp = vals[0]
+        render_temp_line(last_temp, vote_val)
+        update_led_from_temp(last_temp)
+
+async def sensor_task():
+    """convert_temp() → 轮询 conversion_done()（最多 TEMP_TCONV_MS）→ read_probes()"""
     if not _roms:
         return
-    now = time.ticks_ms()
-    if not _temp_pending:
-        if time.ticks_diff(now, _next_temp_start_ms) >= 0:
-            try:
-                ds.convert_temp()
-                _temp_pending = True
-                _temp_conv_ms = now
-            except Exception as e:
-                print("convert_temp err:", e)
-        return
-    if time.ticks_diff(now, _temp_conv_ms) >= TEMP_TCONV_MS:
+    while True:
         try:
-            t = ds.read_temp(_roms[0])
-            if isinstance(t, (int, float)):
-                last_temp = t
-                render_temp_line(last_temp, vote_val)
+            ds.convert_temp()
+            t0 = time.ticks_ms()
+            await asyncio.sleep_ms(TEMP_POLL_MS)
+            while (not ds.conversion_done()
+                   and time.ticks_diff(time.ticks_ms(), t0) < TEMP_TCONV_MS):
+                await asyncio.sleep_ms(TEMP_POLL_MS)
+            read_probes()
         except Exception as e:
-            print("read_temp err:", e)
-        finally:
-            _temp_pending = False
-            _next_temp_start_ms = now + int(TEMP_PERIOD_S * 1000)
+            print("temp err:", e)
+        await asyncio.sleep_ms(int(TEMP_PERIOD_S * 1000))
 
 # ---------------- 灯带刷新 ----------------
 def update_led_from_temp(t):
+    # 查表填充；颜色没变则 show() 不会重写灯带
     try:
-        r,g,b = color_from_temp(t)
-        for i in range(NUM_LEDS):
-            np[i] = (r,g,b)
-        np.write()
+        if t is None:
+            strip.off()
+        else:
+            strip.fill_index(_lut, _lut.index(t))
+        strip.show()
     except Exception:
         pass
 
@@ -294,7 +322,7 @@ def ensure_wifi():
 
 def try_send(temp_c, vote, force=False):
     """定期/强制上报 uid+温度+vote（UDP）"""
-    global _last_send_ms
+    global _last_send_ms, _send_seq
     if not wlan.isconnected():
         return
     now = time.ticks_ms()
@@ -309,61 +337,98 @@ def try_send(temp_c, vote, force=False):
             pkt = "{}:temp:{}:vote:{}".format(uid_hex, "", int(vote))
         else:
             pkt = "{}:temp:{:.2f}:vote:{}".format(uid_hex, float(temp_c), int(vote))
+        # 多探头：附加子传感器温度 temps:<t0>,<t1>,...（读失败留空）
+        if len(last_temps) > 1:
+            pkt += ":temps:" + ",".join("" if t is None else "{:.2f}".format(t) for t in last_temps)
+        # 序号 + 开机毫秒数 + 开机标识：服务端计算丢包率、到达抖动，识别重启
+        seq = (_send_seq + 1) & 0xFFFF
+        pkt += ":seq:{}:up:{}:boot:{}".format(seq, time.ticks_ms(), _boot_id)
 
         peer = _resolve_peer()
         if not peer:
             return
         sock.sendto(pkt.encode(), peer)     # UDP sendto   :contentReference[oaicite:6]{index=6}
+        _send_seq = seq
         print("[SEND]", pkt)
     except Exception as e:
         print("send err:", e)
 
+# ---------------- 任务 ----------------
+async def button_task():
+    """等按钮 IRQ 置位 → 刷新投票行并立刻上报一包"""
+    while True:
+        await _btn_flag.wait()
+        render_vote_line(vote_val)
+        _send_evt.set()  # ✅ 按一下立刻上报一包
+
+async def display_task():
+    """帧缓冲有变化才刷 LCD；多次修改合并成一次 flush"""
+    while True:
+        await _disp_evt.wait()
+        _disp_evt.clear()
+        try:
+            lcd_fb.flush()
+        except Exception as e:
+            print("lcd err:", e)
+
+async def net_task():
+    """Wi-Fi 状态机 + 周期上报；_send_evt 置位时立即强制上报"""
+    wifi_connect()
+    while True:
+        if ensure_wifi():
+            # 只在真正执行 try_send 之后才消费 _send_evt：连网/退避期间的按键留到连上后补发
+            try_send(last_temp, vote_val, force=_send_evt.is_set())
+            _send_evt.clear()
+            wait_ms = int(SEND_INTERVAL_S * 1000) - time.ticks_diff(time.ticks_ms(), _last_send_ms)
+            try:
+                await asyncio.wait_for_ms(_send_evt.wait(), max(1, wait_ms))
+            except asyncio.TimeoutError:
+                pass
+        else:
+            # 未连上时 _send_evt 可能一直置位，不能等它（否则空转），按状态机节奏轮询
+            if _wifi_state == 'idle':
+                wait_ms = time.ticks_diff(_wifi_next_try, time.ticks_ms())
+            else:
+                wait_ms = WIFI_POLL_MS
+            await asyncio.sleep_ms(max(1, wait_ms))
+
 # ---------------- 启动与主循环 ----------------
-print("Board UID:", uid_hex)
-display_line1("Loading...")
-display_line2("UID:"+uid_hex[:10])
-time.sleep(1.0)
-display_line2("")
+async def main():
+    print("Board UID:", uid_hex)
+    display_line1("Loading...")
+    display_line2("UID:"+uid_hex[:10])
+    if lcd_fb is not None: lcd_fb.flush()
 
-# 启动时同步采样一轮 → 避免前几秒 last_temp=None
-try:
+    # 先启动采样任务：首个读数在转换完成后立即可用，不再阻塞等待 750ms
     print("DS18B20 roms:", _roms)
     if not _roms:
         print("WARN: No DS18B20 on pin", TEMP_PIN)
     else:
-        ds.convert_temp()
-        time.sleep_ms(TEMP_TCONV_MS)  # 12-bit 转换典型 750ms  :contentReference[oaicite:7]{index=7}
-        t0 = ds.read_temp(_roms[0])
-        if isinstance(t0, (int, float)):
-            last_temp = t0
-            print("First temp:", last_temp)
-            render_temp_line(last_temp, vote_val)
-except Exception as e:
-    print("First temp read err:", e)
+        setup_probes()
+        asyncio.create_task(sensor_task())
 
-wifi_connect()
-
-try:
-    while True:
-        # 温度 → 灯带 & LCD
-        temp_tick()
-        update_led_from_temp(last_temp)
+    await asyncio.sleep(1.0)
+    display_line2("")
+    if last_temp is not None:
+        print("First temps:", last_temps)
+        render_temp_line(last_temp, vote_val)
 
-        # 网络（不阻塞）
-        ensure_wifi()
-        try_send(last_temp, vote_val)
+    if lcd_fb is not None:
+        asyncio.create_task(display_task())
+    asyncio.create_task(button_task())
+    await net_task()
 
-        time.sleep(0.05)
+try:
+    asyncio.run(main())
 
 except KeyboardInterrupt:
     print("\nExiting")
-    display_line1("Exiting...")
 
 finally:
     try: sock.close(); print("Socket closed")
     except: pass
     try: np.fill((0,0,0)); np.write(); print("LED cleared")
     except: pass
-    try: display_line1("Bye Bye~"); display_line2("")
+    try: display_line1("Bye Bye~"); display_line2(""); lcd_fb.flush()
     except: pass
-
+    asyncio.new_event_loop()
@@ -1,12 +1,23 @@
 # temp_server.py —— UDP温度 + 投票 + HTTP API / SSE（仅新包 +vote）
-# 依赖：aiohttp（pip install aiohttp）
+# 依赖：aiohttp（pip install aiohttp）；可选 numpy（/api/heatmap 向量化对齐）
 # 客户端上报格式（仅支持新格式）：
 #   <uid>:temp:<float>:vote:<int>     # vote ∈ {-1,0,1}
+#   可选键值对追加在后面，如 :temps:<t0>,<t1>,...（多探头子传感器温度）
+#   以及 :seq:<int>:up:<int>（16 位滚动序号 + 设备开机毫秒数，用于链路统计）
 
-import asyncio, socket, json, time, sys
-import contextlib
+import asyncio, socket, json, time, sys, os, math
+import contextlib, itertools, tracemalloc, gzip, hashlib, hmac
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import deque, OrderedDict
 from typing import Dict, Tuple, Any, List, Optional
 from aiohttp import web
+from udp_capture import CaptureWriter
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时 /api/heatmap 走纯 Python 实现
+    np = None
 
 # ================= 配置 =================
 UDP_LISTEN_IP   = "0.0.0.0"
@@ -16,15 +27,89 @@ HTTP_LISTEN_PORT= 5000
 
 HISTORY_MAX     = 200        # 每设备最多保留N条历史
 EXPIRE_SEC      = 60 * 60    # 最近1小时无更新判离线
+
+SSE_BATCH_MS         = 100   # 上报合并窗口：窗口内每设备只推最新一条，整批一次下发
+VOTE_STATS_WINDOWS   = (60, 300, 600, 1800, 3600)  # SSE 推送的投票统计窗口（秒）
+VOTE_STATS_TICK_SEC  = 1.0   # 合并计算间隔：期间多次上报只算一次
+VOTE_STATS_AGE_SEC   = 10.0  # 无新上报时也定期重算（旧票滑出窗口）
+
+SEQ_WINDOW      = 64         # 乱序/重复判定的序号滑动窗口
+REBOOT_SLACK_MS = 30_000     # 未带 boot 的旧固件：传输时延（到达时刻 - up）突增超过该值视为设备重启
+TICKS_PERIOD_MS = 1 << 30    # MicroPython ticks_ms 回绕周期（约 12.4 天），回绕不算重启
+
+# 温度分布直方图：固定分桶，可合并；按时间分片 + 全局各一份
+DIST_MIN_C      = -10.0      # 直方图下界（更低的样本计入第一个桶）
+DIST_MAX_C      = 50.0       # 直方图上界（更高的样本计入最后一个桶）
+DIST_RES_C      = 0.1        # 桶宽（°C）
+DIST_SLICE_SEC  = 60         # 时间分片长度
+DIST_SLICES     = 60         # 保留的分片数（窗口查询上限 = 60 × 60s = 1 小时）
+
+HEATMAP_MAX_COLS = 1440     # 热力图最多列数（超出则自动放大 step）
+HEATMAP_HOLD_SEC = 120      # 网格点取“此前最近一条”，但最多沿用这么久，否则为空
+HEATMAP_MAX_SPAN = 7 * 24 * 3600  # since 最早只能到 now 之前这么久（更早的按此截断）
+
+# UDP 报文录制（回放：python udp_capture.py <file> --speed N）
+RECORD_FILE      = ""                # 录制文件路径；空串表示不录制
+RECORD_MAX_BYTES = 64 * 1024 * 1024  # 单文件上限，超过则轮转为 .1 .2 ...
+RECORD_KEEP      = 3                 # 保留的旧文件数
+RECORD_FLUSH_SEC = 1.0               # 后台批量写盘间隔
+
+ADMIN_LOCAL_ONLY = True     # /api/admin/* 仅允许本机直连（带 X-Forwarded-For / Forwarded 的经代理请求一律拒绝）
+ADMIN_TOKEN      = os.environ.get("TEMP_ADMIN_TOKEN", "")  # 请求头 X-Admin-Token 须与之相同；为空则关闭 /api/admin/*
+
+# 条件请求 / 压缩（/、/api/temps*、/api/vote_stats）
+INDEX_FILE       = "./index.html"    # 首页：缓存在内存并预压缩，文件修改后自动重载
+GZIP_MIN_BYTES   = 1024     # 响应体不小于该值且客户端接受 gzip 时压缩
+GZIP_LEVEL       = 6
+BODY_CACHE_MAX   = 64       # 按 ETag 缓存已编码的 JSON（多个看板轮询同一版本时只编码一次）
+
+ALERT_RULES_FILE = "alerts.json"   # 告警规则（不存在则不启用）
+ALERT_LOG_FILE   = "alerts.log"    # 告警触发/恢复记录（JSON Lines）
+ALERT_SWEEP_SEC  = 5.0             # 定期复查：for 持续时间到点触发、设备超过 EXPIRE_SEC 未上报则移出聚合并恢复其告警
 # ======================================
 
-# temps[uid] = {"temp": float, "vote": int, "ts": float, "addr": (ip,port)}
+# temps[uid] = {"temp": float, "vote": int, "ts": float, "addr": (ip,port), "sensors": [float|None]|None}
 temps: Dict[str, Dict[str, Any]] = {}
 # history[uid] = [{"ts": float, "temp": float, "vote": int}, ...]
 history: Dict[str, List[Dict[str, Any]]] = {}
 
-# SSE 客户端队列
-sse_clients: List[asyncio.Queue] = []
+_sse_ids = itertools.count(1)
+
+class SSEClient:
+    # 单个 SSE 连接：帧队列（已编码的 bytes）+ 是否接收 temp_batch 批量事件
+    # queued_bytes / transport 供 /api/admin/memory 统计积压
+    __slots__ = ("id", "queue", "batch", "queued_bytes", "transport", "peer", "since")
+
+    def __init__(self, batch: bool, transport=None, peer: Optional[str] = None):
+        self.id = next(_sse_ids)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.batch = batch
+        self.queued_bytes = 0
+        self.transport = transport
+        self.peer = peer
+        self.since = time.time()
+
+sse_clients: List[SSEClient] = []
+
+# 待推送的设备更新：pending_updates[uid] = 最新 payload，由 sse_batch_loop 定时整批下发
+pending_updates: Dict[str, Dict[str, Any]] = {}
+
+# 投票统计：上报置脏，由 vote_stats_loop 合并计算并广播
+_vote_stats_dirty = True
+vote_stats_cache: Optional[Dict[str, Any]] = None
+
+# 录制器（RECORD_FILE 非空时在 main() 中创建）
+recorder: Optional[CaptureWriter] = None
+# 单线程写盘执行器（录制、告警日志共用），不阻塞事件循环；同一线程内按提交顺序执行
+_io_pool: Optional[ThreadPoolExecutor] = None
+
+# 资源版本号：每次有效上报递增，用于 ETag / If-None-Match（304）
+_BOOT_TAG = f"{int(time.time()):x}"   # 写进 ETag，重启后旧 ETag 一律失效
+data_ver = 0                           # 全局版本（任一设备上报即 +1）
+uid_ver: Dict[str, int] = {}           # uid_ver[uid] = 该设备最近一次上报时的 data_ver
+
+# link_stats[uid] = LinkStats（仅上报了 seq 的设备）
+link_stats: Dict[str, "LinkStats"] = {}
 
 # ---------- 工具 ----------
 def clamp_vote(v: Optional[int]) -> Optional[int]:
@@ -39,16 +124,475 @@ def vote_tag(v: Optional[int]) -> Optional[str]:
     if v is None: return None
     return "warm" if v > 0 else "cold" if v < 0 else "conf"
 
-def _broadcast_sse(obj: dict):
+def parse_sensors(s: Optional[str]) -> Optional[List[Optional[float]]]:
+    # "26.44,,25.10" -> [26.44, None, 25.1]；空串/缺失 -> None；nan/inf 视为无效读数
+    if not s: return None
+    out: List[Optional[float]] = []
+    for x in s.split(","):
+        try: v = float(x)
+        except ValueError: v = None
+        out.append(v if v is not None and math.isfinite(v) else None)
+    return out
+
+def _sse_frame(event: str, obj: Any) -> bytes:
     data = json.dumps(obj, ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+def _fanout(batch_frame: bytes, legacy_frame: bytes):
+    # 每个客户端一次入队；批量客户端与旧客户端各取对应帧
     dead = []
-    for q in sse_clients:
-        try: q.put_nowait(data)
-        except Exception: dead.append(q)
-    for q in dead:
-        try: sse_clients.remove(q)
+    for c in sse_clients:
+        frame = batch_frame if c.batch else legacy_frame
+        try: c.queue.put_nowait(frame)
+        except Exception: dead.append(c)
+        else: c.queued_bytes += len(frame)
+    for c in dead:
+        try: sse_clients.remove(c)
         except ValueError: pass
 
+def _broadcast_sse(obj: Any, event: str):
+    # 只序列化一次，所有客户端共享同一帧
+    frame = _sse_frame(event, obj)
+    _fanout(frame, frame)
+
+def flush_pending_updates():
+    # 一个窗口内的更新：批量客户端收一条 temp_batch；旧客户端收拼接好的多条 temp（一次写）
+    if not pending_updates:
+        return
+    items = list(pending_updates.values())
+    pending_updates.clear()
+    if not sse_clients:
+        return
+    batch_frame = _sse_frame("temp_batch", {"items": items}) \
+        if any(c.batch for c in sse_clients) else b""
+    legacy_frame = b"".join(_sse_frame("temp", it) for it in items) \
+        if not all(c.batch for c in sse_clients) else b""
+    _fanout(batch_frame, legacy_frame)
+
+async def record_flush_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(RECORD_FLUSH_SEC)
+        chunks = recorder.take()
+        if chunks:
+            try:
+                await loop.run_in_executor(_io_pool, recorder.write, chunks)
+            except OSError as e:
+                print(f"[WARN] record write failed: {e}")
+
+async def alert_sweep_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(ALERT_SWEEP_SEC)
+        alert_engine.sweep(time.time())
+        await flush_alert_log(loop)
+
+async def flush_alert_log(loop):
+    lines = alert_engine.take_log()
+    if lines:
+        try:
+            await loop.run_in_executor(_io_pool, alert_engine.write_log, lines)
+        except OSError as e:
+            print(f"[WARN] alert log write failed: {e}")
+
+async def sse_batch_loop():
+    while True:
+        await asyncio.sleep(SSE_BATCH_MS / 1000.0)
+        flush_pending_updates()
+
+class LinkStats:
+    # 单设备链路统计，常数内存：
+    # - 序号：最大序号 + SEQ_WINDOW 位图，区分丢包 / 乱序 / 重复
+    # - 抖动：RFC 3550 到达抖动，J += (|D| - J) / 16，D 为相邻包传输时延之差
+    # - 重启：boot（每次开机随机生成）变化即开始新周期，开机后很快又崩溃的设备也能识别
+    # - 回绕：传输时延 = 到达时刻 - up，跳变约为 TICKS_PERIOD_MS 时是 ticks_ms 回绕，展开后继续
+    #   未带 boot 的旧固件仍按“时延突增超过 REBOOT_SLACK_MS”判断重启
+    __slots__ = ("max_seq", "base", "bitmap", "received", "expected_prev",
+                 "dup", "reorder", "jitter", "transit", "up_wrap", "boot", "reboots")
+
+    def __init__(self):
+        self.max_seq: Optional[int] = None   # 当前启动周期内的扩展序号（不回绕）
+        self.base = 0                        # 当前启动周期的首个序号
+        self.bitmap = 0                      # bit k = (max_seq - k) 已收到
+        self.received = 0
+        self.expected_prev = 0               # 之前启动周期的期望包数
+        self.dup = 0
+        self.reorder = 0
+        self.jitter = 0.0                    # ms
+        self.transit: Optional[float] = None  # 最近一个按序到达包的传输时延（ms）
+        self.up_wrap = 0                      # 已累计的 ticks_ms 回绕量
+        self.boot: Optional[str] = None       # 当前启动周期的开机标识
+        self.reboots = 0
+
+    def _restart(self, seq: int, up: Optional[int], arrival_ms: float, boot: Optional[str]):
+        if self.max_seq is not None:
+            self.expected_prev += self.max_seq - self.base + 1
+            self.reboots += 1
+        self.max_seq = self.base = seq
+        self.bitmap = 1
+        self.received += 1
+        self.up_wrap = 0
+        self.boot = boot
+        self.transit = None if up is None else arrival_ms - up
+
+    def update(self, seq: int, up: Optional[int], arrival_ms: float, boot: Optional[str] = None):
+        if self.max_seq is None or (boot is not None and boot != self.boot):
+            self._restart(seq, up, arrival_ms, boot)
+            return
+        transit = None
+        if up is not None:
+            transit = arrival_ms - (up + self.up_wrap)
+            if self.transit is not None and transit - self.transit > REBOOT_SLACK_MS:
+                if abs(transit - self.transit - TICKS_PERIOD_MS) <= REBOOT_SLACK_MS:
+                    self.up_wrap += TICKS_PERIOD_MS
+                    transit -= TICKS_PERIOD_MS
+                elif boot is None:
+                    self._restart(seq, up, arrival_ms, boot)
+                    return
+        d = (seq - self.max_seq) & 0xFFFF
+        if d >= 0x8000:
+            d -= 0x10000
+        if d > 0:
+            self.bitmap = ((self.bitmap << d) | 1) & ((1 << SEQ_WINDOW) - 1)
+            self.max_seq += d
+            self.received += 1
+            if transit is not None:
+                if self.transit is not None:
+                    self.jitter += (abs(transit - self.transit) - self.jitter) / 16.0
+                self.transit = transit
+        elif d == 0:
+            self.dup += 1
+        elif -d < SEQ_WINDOW:
+            bit = 1 << -d
+            if self.bitmap & bit:
+                self.dup += 1
+            else:
+                self.bitmap |= bit
+                self.received += 1
+                self.reorder += 1
+        else:
+            # 超出窗口的迟到包：无法判重，按乱序计入
+            self.received += 1
+            self.reorder += 1
+
+    def expected(self) -> int:
+        if self.max_seq is None:
+            return 0
+        return self.expected_prev + self.max_seq - self.base + 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        exp = self.expected()
+        lost = max(0, exp - self.received)
+        return {
+            "seq": None if self.max_seq is None else self.max_seq & 0xFFFF,
+            "received": self.received,
+            "expected": exp,
+            "lost": lost,
+            "loss_rate": round(lost / exp, 4) if exp else 0.0,
+            "dup": self.dup,
+            "reorder": self.reorder,
+            "jitter_ms": round(self.jitter, 1),
+            "reboots": self.reboots,
+        }
+
+# ---------- 告警引擎 ----------
+# alerts.json:
+#   {"zones": {"lab": ["8813bf035bd8", ...]},
+#    "rules": [{"id": "lab-hot", "zone": "lab", "metric": "temp", "op": ">",
+#               "threshold": 28, "clear": 27.5, "for": 300}, ...]}
+# 作用域：uid（单设备）/ zone（分区）/ 都不填（全体）
+# 设备指标 temp / vote：逐设备判断，状态按 (规则, uid) 保存
+# 分区指标 cold_ratio / conf_ratio / warm_ratio / mean_temp：按分区聚合，状态按 (规则, 分区) 保存
+DEVICE_METRICS = ("temp", "vote")
+ZONE_METRICS   = ("cold_ratio", "conf_ratio", "warm_ratio", "mean_temp")
+FLEET = "*"   # 全体设备的作用域键
+
+class AlertRule:
+    __slots__ = ("id", "scope", "metric", "op", "threshold", "clear", "for_sec")
+
+    def __init__(self, d: Dict[str, Any]):
+        self.id = str(d["id"])
+        self.metric = d["metric"]
+        if self.metric not in DEVICE_METRICS + ZONE_METRICS:
+            raise ValueError(f"rule {self.id}: unknown metric {self.metric!r}")
+        if "uid" in d:
+            if self.metric in ZONE_METRICS:
+                raise ValueError(f"rule {self.id}: {self.metric} needs a zone, not a uid")
+            self.scope = ("uid", str(d["uid"]))
+        elif "zone" in d:
+            self.scope = ("zone", str(d["zone"]))
+        else:
+            self.scope = ("zone", FLEET)
+        self.op = d.get("op", ">")
+        if self.op not in (">", "<"):
+            raise ValueError(f"rule {self.id}: op must be '>' or '<'")
+        self.threshold = float(d["threshold"])
+        self.clear = float(d.get("clear", self.threshold))   # 迟滞：恢复阈值
+        self.for_sec = float(d.get("for", 0))                # 持续多久才触发
+
+    def breached(self, v: float) -> bool:
+        return v > self.threshold if self.op == ">" else v < self.threshold
+
+    def cleared(self, v: float) -> bool:
+        return v <= self.clear if self.op == ">" else v >= self.clear
+
+class ZoneAgg:
+    # 分区聚合：按每台设备的最新一条增量维护，O(1) 更新
+    __slots__ = ("n", "temp_sum", "warm", "conf", "cold")
+
+    def __init__(self):
+        self.n = 0; self.temp_sum = 0.0
+        self.warm = 0; self.conf = 0; self.cold = 0
+
+    def apply(self, row: Dict[str, Any], sign: int):
+        self.n += sign
+        self.temp_sum += sign * row["temp"]
+        tag = vote_tag(row.get("vote"))
+        if tag: setattr(self, tag, getattr(self, tag) + sign)
+
+    def metric(self, m: str) -> Optional[float]:
+        if not self.n: return None
+        if m == "mean_temp": return self.temp_sum / self.n
+        return getattr(self, m[:-6]) / self.n   # "cold_ratio" -> cold
+
+class AlertEngine:
+    def __init__(self):
+        self.zone_of: Dict[str, str] = {}
+        self.rules: Dict[str, AlertRule] = {}
+        # 索引：(scope, metric) -> [rule]，每条上报只查与之相关的规则
+        self.index: Dict[Tuple[Tuple[str, str], str], List[AlertRule]] = {}
+        self.aggs: Dict[str, ZoneAgg] = {}
+        # 状态只为“正在越限”或“已触发”的 (rule_id, subject) 保存：{"since", "active", "value"}
+        self.state: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # 计入聚合的设备及其最新一条；超过 EXPIRE_SEC 未上报由 sweep() 移出
+        self.live: Dict[str, Dict[str, Any]] = {}
+        self.log_path: Optional[str] = None
+        self.log_buf: List[str] = []   # 待写盘的日志行，由 alert_sweep_loop 交给 _io_pool
+
+    def load(self, path: str, log_path: Optional[str] = None):
+        with open(path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        if not isinstance(cfg, dict):
+            raise ValueError("alert config must be a JSON object")
+        zones = cfg.get("zones", {})
+        if not isinstance(zones, dict):
+            raise ValueError("zones must be an object of zone -> [uid, ...]")
+        zone_of: Dict[str, str] = {}
+        for z, uids in zones.items():
+            if not isinstance(uids, list) or not all(isinstance(u, str) for u in uids):
+                raise ValueError(f"zone {z!r}: members must be a list of uid strings")
+            for uid in uids:
+                if zone_of.get(uid, z) != z:
+                    raise ValueError(f"uid {uid!r} is in both zone {zone_of[uid]!r} and {z!r}")
+                zone_of[uid] = z
+        rule_list = cfg.get("rules", [])
+        if not isinstance(rule_list, list) or not all(isinstance(d, dict) for d in rule_list):
+            raise ValueError("rules must be a list of objects")
+        rules = [AlertRule(d) for d in rule_list]
+        by_id: Dict[str, AlertRule] = {}
+        for r in rules:
+            if r.id in by_id:
+                raise ValueError(f"duplicate rule id {r.id!r}")
+            by_id[r.id] = r
+        self.zone_of = zone_of
+        self.rules = by_id
+        self.index = {}
+        for r in rules:
+            self.index.setdefault((r.scope, r.metric), []).append(r)
+        self.aggs = {}
+        self.state = {}
+        self.live = {}
+        self.log_path = log_path
+        # 用已有（未过期）数据初始化分区聚合
+        since = time.time() - EXPIRE_SEC
+        for uid, row in temps.items():
+            if row["ts"] >= since:
+                self.live[uid] = row
+                self._agg_apply(uid, row, 1)
+
+    def _agg_apply(self, uid: str, row: Dict[str, Any], sign: int):
+        for z in (self.zone_of.get(uid), FLEET):
+            if z is None: continue
+            agg = self.aggs.get(z)
+            if agg is None:
+                agg = self.aggs[z] = ZoneAgg()
+            agg.apply(row, sign)
+
+    def ingest(self, uid: str, row: Dict[str, Any], now: float):
+        if not self.rules:
+            return
+        prev = self.live.get(uid)
+        if prev is not None:
+            self._agg_apply(uid, prev, -1)
+        self._agg_apply(uid, row, 1)
+        self.live[uid] = row
+
+        zone = self.zone_of.get(uid)
+        scopes = [("uid", uid), ("zone", FLEET)]
+        if zone is not None:
+            scopes.append(("zone", zone))
+        for sc in scopes:
+            for m in DEVICE_METRICS:
+                for r in self.index.get((sc, m), ()):
+                    self._eval(r, uid, float(row[m]), now)
+        for z in (zone, FLEET):
+            if z is None: continue
+            agg = self.aggs[z]
+            for m in ZONE_METRICS:
+                rules = self.index.get((("zone", z), m))
+                if not rules: continue
+                v = agg.metric(m)
+                if v is None: continue
+                for r in rules:
+                    self._eval(r, z, v, now)
+
+    def sweep(self, now: float):
+        # 不依赖新上报的复查：过期设备移出聚合、恢复其设备告警；分区指标与未到点的 for 重新判断
+        if not self.rules:
+            return
+        since = now - EXPIRE_SEC
+        for uid in [u for u, row in self.live.items() if row["ts"] < since]:
+            self._agg_apply(uid, self.live.pop(uid), -1)
+            for key in [k for k in self.state if k[1] == uid and self.rules[k[0]].metric in DEVICE_METRICS]:
+                st = self.state.pop(key)
+                if st["active"]:
+                    self._emit("resolved", self.rules[key[0]], uid, st["value"], now, st["since"], "expired")
+        for key, st in list(self.state.items()):
+            r = self.rules[key[0]]
+            if r.metric in DEVICE_METRICS and not st["active"]:
+                self._eval(r, key[1], st["value"], now)
+        for (scope, m), rules in self.index.items():
+            if m not in ZONE_METRICS:
+                continue
+            z = scope[1]
+            agg = self.aggs.get(z)
+            v = agg.metric(m) if agg is not None else None
+            for r in rules:
+                if v is not None:
+                    self._eval(r, z, v, now)
+                else:
+                    # 分区内已没有在线设备：无从判断，直接恢复
+                    st = self.state.pop((r.id, z), None)
+                    if st is not None and st["active"]:
+                        self._emit("resolved", r, z, st["value"], now, st["since"], "expired")
+
+    def take_log(self) -> List[str]:
+        lines, self.log_buf = self.log_buf, []
+        return lines
+
+    def write_log(self, lines: List[str]):
+        # 在 _io_pool 中执行
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _eval(self, r: AlertRule, subject: str, v: float, now: float):
+        key = (r.id, subject)
+        st = self.state.get(key)
+        if st is None or not st["active"]:
+            if not r.breached(v):
+                if st is not None: del self.state[key]
+                return
+            if st is None:
+                st = self.state[key] = {"since": now, "active": False, "value": v}
+            st["value"] = v
+            if now - st["since"] >= r.for_sec:
+                st["active"] = True
+                self._emit("firing", r, subject, v, now, st["since"])
+        else:
+            st["value"] = v
+            if r.cleared(v):
+                del self.state[key]
+                self._emit("resolved", r, subject, v, now, st["since"])
+
+    def _emit(self, status: str, r: AlertRule, subject: str, v: float, now: float, since: float,
+              reason: Optional[str] = None):
+        ev = {
+            "status": status, "rule": r.id, "subject": subject, "metric": r.metric,
+            "op": r.op, "threshold": r.threshold, "clear": r.clear,
+            "value": round(v, 4), "since": since, "ts": now,
+        }
+        if reason:
+            ev["reason"] = reason   # "expired"：设备/分区超过 EXPIRE_SEC 无上报
+        print(f"[ALERT] {status} {r.id} {subject} {r.metric}={ev['value']}" + (f" ({reason})" if reason else ""))
+        _broadcast_sse(ev, "alert")
+        if self.log_path:
+            self.log_buf.append(json.dumps(ev, ensure_ascii=False) + "\n")
+
+    def active(self) -> List[Dict[str, Any]]:
+        out = []
+        for (rid, subject), st in self.state.items():
+            if st["active"]:
+                r = self.rules[rid]
+                out.append({"rule": rid, "subject": subject, "metric": r.metric,
+                            "value": round(st["value"], 4), "since": st["since"]})
+        return out
+
+alert_engine = AlertEngine()
+
+# ---------- 温度分布 ----------
+DIST_BINS = int(round((DIST_MAX_C - DIST_MIN_C) / DIST_RES_C))
+
+class TempHistogram:
+    # 固定分桶直方图：O(1) 插入，同构可合并；分位数在桶内线性插值，误差 ≤ DIST_RES_C
+    __slots__ = ("counts", "n", "lo", "hi")
+
+    def __init__(self):
+        self.counts = [0] * DIST_BINS
+        self.n = 0
+        self.lo: Optional[float] = None
+        self.hi: Optional[float] = None
+
+    def add(self, t: float):
+        if not math.isfinite(t):
+            return
+        i = int((t - DIST_MIN_C) / DIST_RES_C)
+        if i < 0: i = 0
+        elif i >= DIST_BINS: i = DIST_BINS - 1
+        self.counts[i] += 1
+        self.n += 1
+        if self.lo is None or t < self.lo: self.lo = t
+        if self.hi is None or t > self.hi: self.hi = t
+
+    @classmethod
+    def merged(cls, hists: List["TempHistogram"]) -> "TempHistogram":
+        out = cls()
+        hists = [h for h in hists if h.n]
+        if not hists:
+            return out
+        out.counts = [sum(c) for c in zip(*(h.counts for h in hists))]
+        out.n = sum(h.n for h in hists)
+        out.lo = min(h.lo for h in hists)
+        out.hi = max(h.hi for h in hists)
+        return out
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.n:
+            return None
+        rank = q * self.n
+        acc = 0
+        for i, c in enumerate(self.counts):
+            if c and acc + c >= rank:
+                v = DIST_MIN_C + (i + (rank - acc) / c) * DIST_RES_C
+                return round(min(max(v, self.lo), self.hi), 3)
+            acc += c
+        return self.hi
+
+dist_all = TempHistogram()
+# dist_slices = deque([(slice_start_ts, TempHistogram), ...])，最旧在左
+dist_slices: deque = deque(maxlen=DIST_SLICES)
+
+def dist_add(t: float, now: float):
+    start = int(now // DIST_SLICE_SEC) * DIST_SLICE_SEC
+    if not dist_slices or dist_slices[-1][0] != start:
+        dist_slices.append((start, TempHistogram()))
+    dist_slices[-1][1].add(t)
+    dist_all.add(t)
+
+def _parse_int(s: Optional[str]) -> Optional[int]:
+    if s is None: return None
+    try: return int(s)
+    except ValueError: return None
+
 def _format_row(uid: str, row: Dict[str, Any]) -> Dict[str, Any]:
     ts = row.get("ts", 0.0)
     online = (time.time() - ts) <= EXPIRE_SEC
@@ -64,6 +608,8 @@ def _format_row(uid: str, row: Dict[str, Any]) -> Dict[str, Any]:
         "online": online,
         "ip": ip,
         "port": port,
+        "sensors": row.get("sensors"),
+        "link": link_stats[uid].as_dict() if uid in link_stats else None,
     }
 
 # ---------- UDP 协议 ----------
@@ -73,6 +619,9 @@ class TempUDPProtocol(asyncio.DatagramProtocol):
         print(f"[ OK ] UDP listening on {UDP_LISTEN_IP}:{UDP_LISTEN_PORT}")
 
     def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        global _vote_stats_dirty, data_ver
+        if recorder is not None:
+            recorder.add(time.time(), addr, data)   # 只追加到内存，原样录制（含非法报文）
         msg = data.decode("utf-8", "ignore").strip()
         parts = msg.split(":")
         # 仅接受：<uid>:temp:<float>:vote:<int>[:...]
@@ -83,26 +632,39 @@ class TempUDPProtocol(asyncio.DatagramProtocol):
             t = float(parts[2])
         except ValueError:
             return
+        if not math.isfinite(t):
+            return  # nan / inf / 1e400 一律丢弃，避免写入一半的状态
 
-        # 必须携带 vote；在键值对中查找
-        v: Optional[int] = None
+        # 其余为键值对；必须携带 vote
+        kv: Dict[str, str] = {}
         for i in range(3, len(parts) - 1, 2):
-            if parts[i] == "vote":
-                v = clamp_vote(parts[i+1])
-                break
+            kv.setdefault(parts[i], parts[i+1])
+        v = clamp_vote(kv.get("vote"))
         if v is None:
             return  # 没有 vote 就忽略（按你要求不兼容旧包）
+        sensors = parse_sensors(kv.get("temps"))
 
         now = time.time()
-        temps[uid] = {"temp": t, "vote": v, "ts": now, "addr": addr}
+        seq = _parse_int(kv.get("seq"))
+        if seq is not None:
+            ls = link_stats.get(uid)
+            if ls is None:
+                ls = link_stats[uid] = LinkStats()
+            ls.update(seq & 0xFFFF, _parse_int(kv.get("up")), now * 1000.0, kv.get("boot"))
+        temps[uid] = {"temp": t, "vote": v, "ts": now, "addr": addr, "sensors": sensors}
+        alert_engine.ingest(uid, temps[uid], now)
+        dist_add(t, now)
 
         lst = history.setdefault(uid, [])
         lst.append({"ts": now, "temp": t, "vote": v})
         if len(lst) > HISTORY_MAX:
             del lst[: len(lst) - HISTORY_MAX]
 
-        payload = {"uid": uid, "temp": t, "vote": v, "vote_tag": vote_tag(v), "ts": now}
-        _broadcast_sse(payload)
+        payload = {"uid": uid, "temp": t, "vote": v, "vote_tag": vote_tag(v), "ts": now, "sensors": sensors}
+        pending_updates[uid] = payload  # 合并到下一批，同一设备只保留最新
+        _vote_stats_dirty = True
+        data_ver += 1
+        uid_ver[uid] = data_ver
 
 # ---------- CORS 中间件 ----------
 @web.middleware
@@ -113,37 +675,259 @@ async def cors_mw(request, handler):
         resp = await handler(request)
     resp.headers["Access-Control-Allow-Origin"] = "*"
     resp.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    resp.headers["Access-Control-Allow-Headers"] = "Content-Type, If-None-Match"
+    resp.headers["Access-Control-Expose-Headers"] = "ETag, X-Server-Time, X-Heatmap-Rows, X-Heatmap-Cols, X-Heatmap-T0, X-Heatmap-Step, X-Heatmap-Uids"
     return resp
 
+# ---------- 条件请求 / 压缩 ----------
+# ETag 均为弱校验（W/），同一版本的 gzip 与原文视为等价表示
+# 含时间因素的资源（online、投票窗口）把“当前仍有效的设备数”写进 ETag：
+# 两次上报之间该数只减不增，所以数不变即内容不变
+_body_cache: "OrderedDict[str, List[Optional[bytes]]]" = OrderedDict()  # etag -> [body, gzip body]
+_index_cache: Dict[str, Any] = {}
+
+def _etag_match(request, etag: str) -> bool:
+    inm = request.headers.get("If-None-Match")
+    if not inm:
+        return False
+    want = etag[2:] if etag.startswith("W/") else etag
+    for t in inm.split(","):
+        t = t.strip()
+        if t == "*" or (t[2:] if t.startswith("W/") else t) == want:
+            return True
+    return False
+
+def _conditional(request, etag: str, ent: List[Optional[bytes]], content_type: str) -> web.Response:
+    # ent = [原文, gzip 结果或 None]；gzip 按需生成一次并回写到 ent 中复用
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_match(request, etag):
+        return web.Response(status=304, headers=headers)
+    body = ent[0]
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("Accept-Encoding", ""):
+        if ent[1] is None:
+            ent[1] = gzip.compress(body, GZIP_LEVEL)
+        body = ent[1]
+        headers["Content-Encoding"] = "gzip"
+    return web.Response(body=body, content_type=content_type, charset="utf-8", headers=headers)
+
+def _conditional_json(request, etag: str, build) -> web.Response:
+    # build() 只在需要完整响应且缓存未命中时调用；304 不做任何序列化
+    # 同一 ETag 的原文与 gzip 各只生成一次，所有客户端共用；随时间变化的值（如 now）不要放进 body
+    if _etag_match(request, etag):
+        return _conditional(request, etag, [b""], "application/json")
+    ent = _body_cache.get(etag)
+    if ent is None:
+        ent = _body_cache[etag] = [json.dumps(build()).encode(), None]
+        if len(_body_cache) > BODY_CACHE_MAX:
+            _body_cache.popitem(last=False)
+    else:
+        _body_cache.move_to_end(etag)
+    return _conditional(request, etag, ent, "application/json")
+
+def _load_index() -> Optional[Dict[str, Any]]:
+    try:
+        st = os.stat(INDEX_FILE)
+    except OSError:
+        _index_cache.clear()
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    if _index_cache.get("key") != key:
+        with open(INDEX_FILE, "rb") as f:
+            body = f.read()
+        _index_cache.update(key=key, ent=[body, gzip.compress(body, 9)],
+                            etag=f'W/"{hashlib.sha1(body).hexdigest()[:16]}"')
+    return _index_cache
+
 # ---------- HTTP 路由 ----------
-async def index(request):   # host website
-    return web.FileResponse("./index.html")
+async def index(request):   # host website（内存缓存 + 预压缩）
+    c = _load_index()
+    if c is None:
+        raise web.HTTPNotFound()
+    return _conditional(request, c["etag"], c["ent"], "text/html")
 
 async def api_health(request):  # GET /api/health
     return web.json_response({"ok": True, "time": time.time()})
 
 async def api_all(request):     # GET /api/temps
-    data = [_format_row(uid, row) for uid, row in temps.items()]
-    data.sort(key=lambda x: x["ts"] or 0, reverse=True)
-    return web.json_response({"devices": data})
+    since = time.time() - EXPIRE_SEC
+    n_online = sum(1 for row in temps.values() if row.get("ts", 0.0) >= since)
+
+    def build():
+        data = [_format_row(uid, row) for uid, row in temps.items()]
+        data.sort(key=lambda x: x["ts"] or 0, reverse=True)
+        return {"devices": data}
+    return _conditional_json(request, f'W/"{_BOOT_TAG}-t{data_ver}-{n_online}"', build)
+
+async def api_distribution(request):  # GET /api/temps/distribution?window=600&q=0.5,0.95
+    q = request.rel_url.query
+    try:
+        qs = [float(x) for x in q.get("q", "0.5,0.95").split(",") if x.strip()]
+    except ValueError:
+        return web.json_response({"error": "bad q"}, status=400)
+    if not qs or any(not 0.0 <= x <= 1.0 for x in qs):
+        return web.json_response({"error": "q must be in [0, 1]"}, status=400)
+    try:
+        window = int(q.get("window", "0"))   # 0 / 缺省：全部历史
+    except ValueError:
+        window = 0
+
+    max_window = DIST_SLICES * DIST_SLICE_SEC
+    if window > max_window:
+        return web.json_response({"error": f"window must be <= {max_window}", "max_window": max_window},
+                                 status=400)
+
+    now = time.time()
+    if window > 0:
+        since = now - window
+        # 分片粒度：与窗口有重叠的分片整体计入
+        h = TempHistogram.merged([hist for start, hist in dist_slices
+                                  if start + DIST_SLICE_SEC > since])
+    else:
+        h = dist_all
+
+    return web.json_response({
+        "window": window or None,
+        "now": now,
+        "count": h.n,
+        "min": h.lo,
+        "max": h.hi,
+        "resolution": DIST_RES_C,
+        "quantiles": {str(x): h.quantile(x) for x in qs},
+    })
 
 async def api_one(request):     # GET /api/temps/{uid}
     uid = request.match_info.get("uid", "")
     row = temps.get(uid)
     if not row:
         return web.json_response({"error": "not found", "uid": uid}, status=404)
-    return web.json_response(_format_row(uid, row))
+    online = int(time.time() - row.get("ts", 0.0) <= EXPIRE_SEC)
+    return _conditional_json(request, f'W/"{_BOOT_TAG}-u{uid_ver.get(uid, 0)}-{online}"',
+                             lambda: _format_row(uid, row))
 
 async def api_history(request): # GET /api/temps/{uid}/history
     uid = request.match_info.get("uid", "")
     arr = history.get(uid) or []
-    # 附上 tag（不改变原存储）
-    out = []
-    for it in arr:
-        o = {"ts": it["ts"], "temp": it["temp"], "vote": it["vote"], "vote_tag": vote_tag(it["vote"])}
-        out.append(o)
-    return web.json_response({"uid": uid, "history": out})
+
+    def build():
+        # 附上 tag（不改变原存储）
+        out = []
+        for it in arr:
+            o = {"ts": it["ts"], "temp": it["temp"], "vote": it["vote"], "vote_tag": vote_tag(it["vote"])}
+            out.append(o)
+        return {"uid": uid, "history": out}
+    if uid not in uid_ver:
+        return web.json_response(build())
+    return _conditional_json(request, f'W/"{_BOOT_TAG}-h{uid_ver[uid]}"', build)
+
+def _heatmap_numpy(hists: List[List[Dict[str, Any]]], grid: List[float], hold: float):
+    # 所有设备的样本拼成一个有序数组：key = 行号 * span + (ts - base)
+    # 一次 searchsorted 即可为每个 (设备, 网格点) 找到“此前最近一条”
+    counts = np.fromiter((len(a) for a in hists), dtype=np.int64, count=len(hists))
+    total = int(counts.sum())
+    g = np.asarray(grid, dtype=np.float64)
+    R, C = len(hists), len(grid)
+    if not total:
+        empty = np.full((R, C), np.nan, dtype=np.float32)
+        return empty, empty.copy()
+    ts = np.fromiter((it["ts"] for a in hists for it in a), dtype=np.float64, count=total)
+    tv = np.fromiter((it["temp"] for a in hists for it in a), dtype=np.float64, count=total)
+    vv = np.fromiter((it["vote"] for a in hists for it in a), dtype=np.float64, count=total)
+
+    base = min(ts.min(), g[0])
+    span = max(ts.max(), g[-1]) - base + 1.0
+    rows = np.repeat(np.arange(R, dtype=np.float64), counts)
+    keys = rows * span + (ts - base)
+    gkeys = np.arange(R, dtype=np.float64)[:, None] * span + (g - base)[None, :]
+    idx = np.searchsorted(keys, gkeys, side="right") - 1
+
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ic = np.clip(idx, 0, total - 1)
+    valid = (idx >= starts[:, None]) & ((g[None, :] - ts[ic]) <= hold)
+    temp = np.where(valid, tv[ic], np.nan).astype(np.float32)
+    vote = np.where(valid, vv[ic], np.nan).astype(np.float32)
+    return temp, vote
+
+def _heatmap_python(hists: List[List[Dict[str, Any]]], grid: List[float], hold: float):
+    # 纯 Python：每台设备双指针走一遍样本与网格，O(样本数 + 列数)
+    nan = float("nan")
+    T, V = [], []
+    for arr in hists:
+        trow, vrow = [], []
+        j, n = -1, len(arr)
+        for g in grid:
+            while j + 1 < n and arr[j + 1]["ts"] <= g:
+                j += 1
+            if j >= 0 and g - arr[j]["ts"] <= hold:
+                trow.append(float(arr[j]["temp"])); vrow.append(float(arr[j]["vote"]))
+            else:
+                trow.append(nan); vrow.append(nan)
+        T.append(trow); V.append(vrow)
+    return T, V
+
+def _matrix_json(m) -> List[List[Optional[float]]]:
+    if np is not None and isinstance(m, np.ndarray):
+        out = np.round(m.astype(np.float64), 2).astype(object)
+        out[np.isnan(m)] = None
+        return out.tolist()
+    return [[None if x != x else round(x, 2) for x in row] for row in m]
+
+def _matrix_f32(m) -> bytes:
+    # 行优先 float32 小端
+    if np is not None and isinstance(m, np.ndarray):
+        return m.astype("<f4").tobytes()
+    a = array("f", (x for row in m for x in row))
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+async def api_heatmap(request):  # GET /api/heatmap?since=<ts>&step=60[&format=f32]
+    q = request.rel_url.query
+    now = time.time()
+    try:
+        since = float(q.get("since", now - 3600))
+        step = float(q.get("step", "60"))
+    except ValueError:
+        return web.json_response({"error": "bad since/step"}, status=400)
+    if not (math.isfinite(since) and math.isfinite(step)):
+        return web.json_response({"error": "bad since/step"}, status=400)
+    step = max(1.0, step)
+    since = min(max(since, now - HEATMAP_MAX_SPAN), now)
+    cols = int((now - since) // step) + 1
+    if cols > HEATMAP_MAX_COLS:
+        step = (now - since) / (HEATMAP_MAX_COLS - 1)
+        cols = HEATMAP_MAX_COLS
+    grid = [since + i * step for i in range(cols)]
+    hold = max(step, HEATMAP_HOLD_SEC)
+
+    # 只保留在网格范围内可能有值的设备，按 uid 排序
+    uids = sorted(uid for uid, arr in history.items() if arr and arr[-1]["ts"] >= since - hold)
+    hists = [history[uid] for uid in uids]
+    if np is not None:
+        temp, vote = _heatmap_numpy(hists, grid, hold)
+    else:
+        temp, vote = _heatmap_python(hists, grid, hold)
+
+    if q.get("format") == "f32":
+        # 二进制：temp 矩阵后接 vote 矩阵（rows × cols，float32，NaN 表示无数据）
+        return web.Response(
+            body=_matrix_f32(temp) + _matrix_f32(vote),
+            content_type="application/octet-stream",
+            headers={
+                "X-Heatmap-Rows": str(len(uids)),
+                "X-Heatmap-Cols": str(cols),
+                "X-Heatmap-T0": repr(since),
+                "X-Heatmap-Step": repr(step),
+                "X-Heatmap-Uids": ",".join(uids),
+            },
+        )
+    return web.json_response({
+        "since": since,
+        "step": step,
+        "cols": cols,
+        "uids": uids,
+        "temp": _matrix_json(temp),
+        "vote": _matrix_json(vote),
+    })
 
 async def api_vote_stats(request):  # GET /api/vote_stats?window=600
     q = request.rel_url.query
@@ -155,56 +939,298 @@ async def api_vote_stats(request):  # GET /api/vote_stats?window=600
     now = time.time()
     since = now - max(1, window)
 
-    def zero():
-        return {"warm": 0, "conf": 0, "cold": 0}
+    # 窗口内有效设备数只会因上报而增加、因老化而减少
+    n_live = sum(1 for row in temps.values() if row.get("ts", 0.0) >= since)
+
+    def build():
+        def zero():
+            return {"warm": 0, "conf": 0, "cold": 0}
 
-    total = {"warm": 0, "conf": 0, "cold": 0}
-    per = {}
+        total = {"warm": 0, "conf": 0, "cold": 0}
+        per = {}
 
-    # 一机一票：对每个 uid 仅取“时间窗内的最近一条”
-    for uid, arr in history.items():
-        last = None
-        # arr 是按时间 append 的，倒序找第一条进入窗口的
-        for it in reversed(arr):
-            ts = it.get("ts", 0.0)
-            if ts < since:
+        # 一机一票：对每个 uid 仅取“时间窗内的最近一条”
+        for uid, arr in history.items():
+            last = None
+            # arr 是按时间 append 的，倒序找第一条进入窗口的
+            for it in reversed(arr):
+                ts = it.get("ts", 0.0)
+                if ts < since:
+                    break
+                last = it
                 break
-            last = it
-            break
 
-        if not last:
-            # 兜底：若 history 被裁剪，但 temps 里有且在窗口内，则也可计入
-            row = temps.get(uid)
-            if not row or row.get("ts", 0.0) < since:
+            if not last:
+                # 兜底：若 history 被裁剪，但 temps 里有且在窗口内，则也可计入
+                row = temps.get(uid)
+                if not row or row.get("ts", 0.0) < since:
+                    continue
+                last = {"ts": row.get("ts"), "temp": row.get("temp"), "vote": row.get("vote")}
+
+            v = clamp_vote(last.get("vote"))
+            if v is None:
+                continue
+            tag = vote_tag(v)
+            if not tag:
                 continue
-            last = {"ts": row.get("ts"), "temp": row.get("temp"), "vote": row.get("vote")}
 
-        v = clamp_vote(last.get("vote"))
-        if v is None:
-            continue
-        tag = vote_tag(v)
+            total[tag] += 1
+            per[uid] = {
+                "warm": 1 if tag == "warm" else 0,
+                "conf": 1 if tag == "conf" else 0,
+                "cold": 1 if tag == "cold" else 0,
+            }
+
+        payload = {
+            "window": window,
+            "total": total,
+            "per_uid": per,                 # 总是返回
+            "device_count": len(per),       # 方便前端直接用
+        }
+        return payload
+    resp = _conditional_json(request, f'W/"{_BOOT_TAG}-v{data_ver}-{window}-{n_live}"', build)
+    resp.headers["X-Server-Time"] = repr(now)   # 计算时刻放在响应头，body 按版本缓存
+    return resp
+
+
+
+def compute_vote_stats(now: float) -> Dict[str, Any]:
+    # 一次遍历同时统计 VOTE_STATS_WINDOWS 中所有窗口（一机一票：每设备取最新一条）
+    wins = {w: {"total": {"warm": 0, "conf": 0, "cold": 0}, "device_count": 0}
+            for w in VOTE_STATS_WINDOWS}
+    for row in temps.values():
+        tag = vote_tag(clamp_vote(row.get("vote")))
         if not tag:
             continue
+        age = now - row.get("ts", 0.0)
+        for w, st in wins.items():
+            if age <= w:
+                st["total"][tag] += 1
+                st["device_count"] += 1
+    return {"now": now, "windows": {str(w): st for w, st in wins.items()}}
 
-        total[tag] += 1
-        per[uid] = {
-            "warm": 1 if tag == "warm" else 0,
-            "conf": 1 if tag == "conf" else 0,
-            "cold": 1 if tag == "cold" else 0,
-        }
+async def vote_stats_loop():
+    # 合并计算：每 tick 至多算一次；结果变化才广播 vote_stats 事件
+    global _vote_stats_dirty, vote_stats_cache
+    last_calc = 0.0
+    while True:
+        await asyncio.sleep(VOTE_STATS_TICK_SEC)
+        now = time.time()
+        if not _vote_stats_dirty and now - last_calc < VOTE_STATS_AGE_SEC:
+            continue
+        _vote_stats_dirty = False
+        last_calc = now
+        stats = compute_vote_stats(now)
+        if vote_stats_cache is None or stats["windows"] != vote_stats_cache["windows"]:
+            vote_stats_cache = stats
+            _broadcast_sse(stats, "vote_stats")
+
+async def api_link_stats(request):  # GET /api/link_stats
+    # 全网链路汇总 + 丢包率最高的设备
+    q = request.rel_url.query
+    try:
+        top = int(q.get("top", "10"))
+    except ValueError:
+        top = 10
+
+    received = expected = lost = dup = reorder = reboots = 0
+    jitters: List[float] = []
+    rows = []
+    for uid, ls in link_stats.items():
+        d = ls.as_dict()
+        received += d["received"]; expected += d["expected"]; lost += d["lost"]
+        dup += d["dup"]; reorder += d["reorder"]; reboots += d["reboots"]
+        jitters.append(ls.jitter)
+        rows.append({"uid": uid, **d})
+    rows.sort(key=lambda x: x["loss_rate"], reverse=True)
 
     payload = {
-        "window": window,
-        "now": now,
-        "total": total,
-        "per_uid": per,                 # 总是返回
-        "device_count": len(per),       # 方便前端直接用
+        "now": time.time(),
+        "device_count": len(rows),
+        "received": received,
+        "expected": expected,
+        "lost": lost,
+        "loss_rate": round(lost / expected, 4) if expected else 0.0,
+        "dup": dup,
+        "reorder": reorder,
+        "reboots": reboots,
+        "jitter_ms_mean": round(sum(jitters) / len(jitters), 1) if jitters else 0.0,
+        "jitter_ms_max": round(max(jitters), 1) if jitters else 0.0,
+        "worst": rows[:max(0, top)],
+    }
+    return web.json_response(payload)
+
+async def api_alerts(request):  # GET /api/alerts
+    return web.json_response({
+        "now": time.time(),
+        "rules": len(alert_engine.rules),
+        "active": alert_engine.active(),
+    })
+
+# ---------- 管理：内存统计 ----------
+def _deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    # 递归累计容器及其内容的 sys.getsizeof（同一对象只计一次）
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _deep_sizeof(k, seen) + _deep_sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for x in obj:
+            size += _deep_sizeof(x, seen)
+    elif hasattr(obj, "__slots__"):
+        for name in obj.__slots__:
+            if hasattr(obj, name):
+                size += _deep_sizeof(getattr(obj, name), seen)
+    return size
+
+def _rss_bytes() -> Optional[int]:
+    # Linux 读 /proc；其它平台退回峰值 RSS
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+def _admin_denied(request) -> Optional[web.Response]:
+    # 自定义请求头不在 CORS 白名单内，其他网页无法跨域带上 X-Admin-Token
+    if not ADMIN_TOKEN:
+        return web.json_response({"error": "admin disabled (set TEMP_ADMIN_TOKEN)"}, status=403)
+    if ADMIN_LOCAL_ONLY and (request.remote not in ("127.0.0.1", "::1")
+                             or "X-Forwarded-For" in request.headers or "Forwarded" in request.headers):
+        return web.json_response({"error": "forbidden"}, status=403)
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), ADMIN_TOKEN.encode()):
+        return web.json_response({"error": "bad admin token"}, status=403)
+    return None
+
+async def api_admin_memory(request):  # GET /api/admin/memory
+    denied = _admin_denied(request)
+    if denied: return denied
+
+    clients = []
+    for c in sse_clients:
+        transport = c.transport
+        clients.append({
+            "id": c.id,
+            "peer": c.peer,
+            "batch": c.batch,
+            "since": c.since,
+            "queue_depth": c.queue.qsize(),
+            "queued_bytes": c.queued_bytes,
+            "write_buffer_bytes": transport.get_write_buffer_size()
+                                  if transport is not None and not transport.is_closing() else None,
+        })
+    traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+
+    payload = {
+        "now": time.time(),
+        "rss_bytes": _rss_bytes(),
+        "temps": {"devices": len(temps), "bytes": _deep_sizeof(temps)},
+        "history": {
+            "devices": len(history),
+            "samples": sum(len(a) for a in history.values()),
+            "bytes": _deep_sizeof(history),
+        },
+        "link_stats": {"devices": len(link_stats), "bytes": _deep_sizeof(link_stats)},
+        "pending_updates": {"items": len(pending_updates), "bytes": _deep_sizeof(pending_updates)},
+        "distribution": {"slices": len(dist_slices),
+                         "bytes": _deep_sizeof(dist_slices) + _deep_sizeof(dist_all)},
+        "alerts": {"rules": len(alert_engine.rules), "states": len(alert_engine.state),
+                   "bytes": _deep_sizeof(alert_engine.index) + _deep_sizeof(alert_engine.state)
+                            + _deep_sizeof(alert_engine.aggs) + _deep_sizeof(alert_engine.live)},
+        "body_cache": {"entries": len(_body_cache), "bytes": _deep_sizeof(_body_cache)},
+        "recorder": None if recorder is None else
+                    {"buffered_records": len(recorder.buf), "buffered_bytes": recorder.buffered},
+        "sse": {
+            "clients": len(clients),
+            "queued_frames": sum(c["queue_depth"] for c in clients),
+            "queued_bytes": sum(c["queued_bytes"] for c in clients),
+            "per_client": clients,
+        },
+        "tracemalloc": {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": traced[0] if traced else None,
+            "peak_bytes": traced[1] if traced else None,
+        },
     }
     return web.json_response(payload)
 
+# tracemalloc 基线快照（snapshot 设置，diff 与之比较后滚动为新基线）
+_tm_baseline: Optional[tracemalloc.Snapshot] = None
+
+def _tm_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
 
+def _tm_stat(st) -> Dict[str, Any]:
+    out = {"where": str(st.traceback[0]) if st.traceback else None,
+           "bytes": st.size, "count": st.count}
+    if hasattr(st, "size_diff"):
+        out["bytes_diff"] = st.size_diff
+        out["count_diff"] = st.count_diff
+    return out
 
-async def api_sse(request):     # GET /api/sse
+async def api_admin_tracemalloc(request):  # GET（status）/ POST /api/admin/tracemalloc?action=start|stop|snapshot|diff&top=20
+    global _tm_baseline
+    denied = _admin_denied(request)
+    if denied: return denied
+
+    q = request.rel_url.query
+    action = q.get("action", "status")
+    if action != "status" and request.method != "POST":
+        return web.json_response({"error": f"{action} requires POST"}, status=405)
+    try:
+        top = max(1, int(q.get("top", "20")))
+        frames = max(1, int(q.get("frames", "1")))
+    except ValueError:
+        return web.json_response({"error": "bad top/frames"}, status=400)
+
+    if action == "start":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        _tm_baseline = None
+    elif action == "stop":
+        tracemalloc.stop()
+        _tm_baseline = None
+    elif action in ("snapshot", "diff"):
+        if not tracemalloc.is_tracing():
+            return web.json_response({"error": "tracemalloc not started"}, status=409)
+        snap = _tm_snapshot()
+        if action == "diff" and _tm_baseline is not None:
+            stats = [_tm_stat(st) for st in snap.compare_to(_tm_baseline, "lineno")[:top]]
+        else:
+            stats = [_tm_stat(st) for st in snap.statistics("lineno")[:top]]
+        _tm_baseline = snap
+        return web.json_response({"action": action, "top": stats,
+                                  "traced_bytes": tracemalloc.get_traced_memory()[0]})
+    elif action != "status":
+        return web.json_response({"error": f"unknown action {action!r}"}, status=400)
+
+    traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+    return web.json_response({
+        "action": action,
+        "tracing": tracemalloc.is_tracing(),
+        "traced_bytes": traced[0] if traced else None,
+        "peak_bytes": traced[1] if traced else None,
+        "has_baseline": _tm_baseline is not None,
+    })
+
+async def api_sse(request):     # GET /api/sse[?batch=1]
     # SSE 基础格式：text/event-stream，按行写 event:/data:，以空行分隔。:contentReference[oaicite:3]{index=3}
     resp = web.StreamResponse(
         status=200,
@@ -218,29 +1244,33 @@ async def api_sse(request):     # GET /api/sse
     )
     await resp.prepare(request)
 
-    q: asyncio.Queue = asyncio.Queue()
-    sse_clients.append(q)
+    batch = request.rel_url.query.get("batch", "").lower() in ("1", "true")
+    client = SSEClient(batch, request.transport, request.remote)
+    q = client.queue
+    sse_clients.append(client)
     print(f"[SSE] client +1, total={len(sse_clients)}")
 
     try:
         snapshot = {"devices": [_format_row(uid, row) for uid, row in temps.items()]}
-        await resp.write(b"event: snapshot\n")
-        await resp.write(f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n".encode())
+        await resp.write(_sse_frame("snapshot", snapshot))
+        if vote_stats_cache is not None:
+            await resp.write(_sse_frame("vote_stats", vote_stats_cache))
 
         while True:
-            data = await q.get()
-            await resp.write(b"event: temp\n")
-            await resp.write(f"data: {data}\n\n".encode())
-            await resp.write(b"event: temp\n")
-            await resp.write(f"data: {data}\n\n".encode())
-# 不再需要 await resp.drain()
+            # 积压的帧合并成一次写
+            frames = [await q.get()]
+            while not q.empty():
+                frames.append(q.get_nowait())
+            data = b"".join(frames)
+            client.queued_bytes -= len(data)
+            await resp.write(data)
 
     except asyncio.CancelledError:
         pass
     except ConnectionResetError:
         pass
     finally:
-        try: sse_clients.remove(q)
+        try: sse_clients.remove(client)
         except ValueError: pass
         print(f"[SSE] client -1, total={len(sse_clients)}")
     return resp
@@ -251,9 +1281,16 @@ def make_app():
         web.get("/", index),
         web.get("/api/health", api_health),
         web.get("/api/temps",  api_all),
+        web.get("/api/temps/distribution", api_distribution),   # 须在 {uid} 之前
         web.get("/api/temps/{uid}", api_one),
         web.get("/api/temps/{uid}/history", api_history),
         web.get("/api/vote_stats", api_vote_stats),
+        web.get("/api/heatmap", api_heatmap),
+        web.get("/api/link_stats", api_link_stats),
+        web.get("/api/alerts", api_alerts),
+        web.get("/api/admin/memory", api_admin_memory),
+        web.get("/api/admin/tracemalloc", api_admin_tracemalloc),
+        web.post("/api/admin/tracemalloc", api_admin_tracemalloc),
         web.get("/api/sse", api_sse),
         web.options("/{tail:.*}", api_health),
     ])
@@ -261,8 +1298,16 @@ def make_app():
 
 # ---------- 主入口（跨平台退出） ----------
 async def main():
+    global recorder, _io_pool
     loop = asyncio.get_running_loop()
 
+    if os.path.exists(ALERT_RULES_FILE):
+        try:
+            alert_engine.load(ALERT_RULES_FILE, ALERT_LOG_FILE)
+            print(f"[ OK ] {len(alert_engine.rules)} alert rules from {ALERT_RULES_FILE}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[WARN] alert rules not loaded: {e}")
+
     # UDP（asyncio DatagramTransport/Protocol）:contentReference[oaicite:4]{index=4}
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -270,6 +1315,15 @@ async def main():
     transport, _ = await loop.create_datagram_endpoint(
         lambda: TempUDPProtocol(), sock=udp_sock
     )
+    _io_pool = ThreadPoolExecutor(max_workers=1)
+    stats_task = asyncio.create_task(vote_stats_loop())
+    batch_task = asyncio.create_task(sse_batch_loop())
+    alert_task = asyncio.create_task(alert_sweep_loop())
+    record_task = None
+    if RECORD_FILE:
+        recorder = CaptureWriter(RECORD_FILE, RECORD_MAX_BYTES, RECORD_KEEP)
+        record_task = asyncio.create_task(record_flush_loop())
+        print(f"[ OK ] recording UDP to {RECORD_FILE}")
 
     # HTTP（aiohttp Web）:contentReference[oaicite:5]{index=5}
     app = make_app()
@@ -283,11 +1337,21 @@ async def main():
     try:
         while True:
             await asyncio.sleep(3600)
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         pass
 
     print("[CLEANUP] closing ...")
+    # 先关 UDP：之后不会再有 datagram_received 往录制缓冲里追加
     transport.close()
+    stats_task.cancel()
+    batch_task.cancel()
+    alert_task.cancel()
+    # 同一单线程执行器排队执行，保证在进行中的写盘之后再收尾
+    await flush_alert_log(loop)
+    if record_task is not None:
+        record_task.cancel()
+        await loop.run_in_executor(_io_pool, recorder.close, recorder.take())
+    _io_pool.shutdown()
     await runner.cleanup()
 
 
@@ -0,0 +1,141 @@
+# udp_capture.py —— UDP 报文录制（供 temp_server 使用）+ 按原始节奏回放工具
+# 录制文件格式（小端）：
+#   文件头  b"UQCAP1\n"
+#   每条记录 <d ts><H port><B ip_len><H data_len> + ip(utf-8) + data
+# 回放：
+#   python udp_capture.py capture.bin                    # 1× 原速发往 127.0.0.1:8080
+#   python udp_capture.py capture.bin --speed 10         # 10× 加速
+#   python udp_capture.py capture.bin --speed 0          # 尽可能快
+#   python udp_capture.py capture.bin.1 capture.bin      # 多个文件按给定顺序连续回放（轮转后 .1 是较旧的一份）
+
+import argparse, os, socket, struct, sys, time
+from typing import Iterator, List, Optional, Tuple
+
+MAGIC = b"UQCAP1\n"
+_REC = struct.Struct("<dHBH")
+
+
+class CaptureWriter:
+    # 热路径只做 struct.pack + 追加到内存列表；flush() 由后台批量写盘（可放到线程池执行）
+    # 文件超过 max_bytes 时轮转：path -> path.1 -> path.2 ...，最多保留 keep 个旧文件
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, keep: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.buf: List[bytes] = []
+        self.buffered = 0
+        self.written = 0     # 当前文件已写字节数
+        self.records = 0     # 累计录制条数
+        self.f = None
+
+    def add(self, ts: float, addr: Tuple[str, int], data: bytes):
+        ip = addr[0].encode()
+        rec = _REC.pack(ts, addr[1] & 0xFFFF, len(ip), len(data)) + ip + data
+        self.buf.append(rec)
+        self.buffered += len(rec)
+        self.records += 1
+
+    def take(self) -> List[bytes]:
+        # 取走当前缓冲（在事件循环线程调用），随后交给 write() 写盘
+        chunks, self.buf, self.buffered = self.buf, [], 0
+        return chunks
+
+    def _open(self):
+        self.f = open(self.path, "ab")
+        self.written = self.f.tell()
+        if self.written == 0:
+            self.f.write(MAGIC)
+            self.written = len(MAGIC)
+
+    def _rotate(self):
+        self.f.close()
+        self.f = None
+        for i in range(self.keep - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.keep > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def write(self, chunks: List[bytes]):
+        if not chunks:
+            return
+        if self.f is None:
+            self._open()
+        for rec in chunks:
+            if self.written + len(rec) > self.max_bytes and self.written > len(MAGIC):
+                self._rotate()
+                self._open()
+            self.f.write(rec)
+            self.written += len(rec)
+        self.f.flush()
+
+    def close(self, chunks: Optional[List[bytes]] = None):
+        # 在线程池中收尾时，由事件循环线程先 take() 再把 chunks 传进来，避免与 add() 并发换缓冲
+        self.write(self.take() if chunks is None else chunks)
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, Tuple[str, int], bytes]]:
+    # 逐条读取 (ts, (ip, port), data)；文件尾部不完整的记录（如进程被杀）直接忽略
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a capture file")
+        while True:
+            head = f.read(_REC.size)
+            if len(head) < _REC.size:
+                return
+            ts, port, ip_len, data_len = _REC.unpack(head)
+            body = f.read(ip_len + data_len)
+            if len(body) < ip_len + data_len:
+                return
+            yield ts, (body[:ip_len].decode(), port), body[ip_len:]
+
+
+def replay(paths: List[str], host: str, port: int, speed: float,
+           limit: Optional[int] = None) -> int:
+    # speed > 0：按录制时的到达间隔 / speed 发送；speed <= 0：不等待
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    t0_rec = t0_wall = None
+    try:
+        for path in paths:
+            for ts, _src, data in read_capture(path):
+                if limit is not None and sent >= limit:
+                    return sent
+                if speed > 0:
+                    if t0_rec is None:
+                        t0_rec, t0_wall = ts, time.perf_counter()
+                    delay = (ts - t0_rec) / speed - (time.perf_counter() - t0_wall)
+                    if delay > 0:
+                        time.sleep(delay)
+                sock.sendto(data, (host, port))
+                sent += 1
+    finally:
+        sock.close()
+    return sent
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Replay a temp_server UDP capture")
+    ap.add_argument("files", nargs="+", help="capture files, replayed in the given order")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--speed", type=float, default=1.0,
+                    help="1 = real time, N = N times faster, 0 = as fast as possible")
+    ap.add_argument("--limit", type=int, default=None, help="stop after N datagrams")
+    args = ap.parse_args(argv)
+
+    t = time.perf_counter()
+    n = replay(args.files, args.host, args.port, args.speed, args.limit)
+    dt = time.perf_counter() - t
+    print(f"[REPLAY] {n} datagrams in {dt:.2f}s ({n / dt if dt > 0 else 0:.0f}/s) -> {args.host}:{args.port}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())